@@ -6,12 +6,17 @@ Crawler for An Giang TV (ATV3 / KG2) — produce atv3kg2.xml (XMLTV)
 - parses rows .tbl-row -> .time and .program
 - builds <programme start=... stop=... channel="atv3kg2">...
 """
+import re
 import sys
 from datetime import datetime, date, time, timedelta
+from itertools import zip_longest
+from operator import itemgetter
 from zoneinfo import ZoneInfo
 import requests
-from bs4 import BeautifulSoup
-import xml.etree.ElementTree as ET
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from bs4 import BeautifulSoup, SoupStrainer
+from lxml import etree as ET
 
 # Config
 CHANNEL_ID = "atv3kg2"
@@ -19,19 +24,35 @@ CHANNEL_NAME = "An Giang 3"
 BASE_URL = "https://angiangtv.vn/lich-phat-song/"
 OUT_FILE = "atv3kg2.xml"
 TZ = ZoneInfo("Asia/Ho_Chi_Minh")  # +07:00
+XMLTV_TIME_FMT = "%Y%m%d%H%M%S +0700"
+TITLE_ATTRS = {"lang": "vi"}  # dùng chung cho mọi <title>, SubElement chỉ đọc
+# ký tự không hợp lệ trong XML 1.0 (điều khiển C0, surrogate lẻ, U+FFFE/U+FFFF):
+# lxml.etree từ chối (ValueError)
+XML_INVALID_CHARS = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff\ufffe\uffff]")
 
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (compatible; lps_crawler/1.0; +https://github.com/hoanghai81/lps_crawler)"
 }
 
+# Một Session dùng chung: giữ kết nối keep-alive, không phải bắt tay TLS lại
+SESSION = requests.Session()
+SESSION.headers.update(HEADERS)
+SESSION.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=4,
+                                      max_retries=Retry(total=2, backoff_factor=0.3)))
+
 def fetch_html_for(date_obj: date):
     params = {"ngay": date_obj.strftime("%Y-%m-%d"), "kenh": "TV2"}
-    resp = requests.get(BASE_URL, params=params, headers=HEADERS, timeout=30)
+    resp = SESSION.get(BASE_URL, params=params, timeout=30)
     resp.raise_for_status()
-    return resp.text
+    # trả bytes (utf-8): parser giải mã trực tiếp, không qua resp.text
+    return resp.content
 
 def parse_rows(html_text):
-    soup = BeautifulSoup(html_text, "html.parser")
+    # chỉ dựng cây cho <div>; bỏ qua head/script/style/menu.
+    # lọc theo class để select() lo: strainer so khớp chuỗi class thô,
+    # sẽ bỏ sót dòng có nhiều class như "tbl-row odd"
+    soup = BeautifulSoup(html_text, "lxml", from_encoding="utf-8",
+                         parse_only=SoupStrainer("div"))
     rows = soup.select("div.tbl-row")
     items = []
     for r in rows:
@@ -40,7 +61,7 @@ def parse_rows(html_text):
         if not t_el or not p_el:
             continue
         time_text = t_el.get_text(strip=True)
-        prog_text = p_el.get_text(" ", strip=True)
+        prog_text = XML_INVALID_CHARS.sub("", p_el.get_text(" ", strip=True))
         items.append((time_text, prog_text))
     return items
 
@@ -51,7 +72,7 @@ def make_dt_for(today: date, hhmm_str: str):
         raise ValueError("Unknown time format: %r" % s)
     hh = int(parts[0])
     mm = int(parts[1])
-    return datetime.combine(today, time(hour=hh, minute=mm)).replace(tzinfo=TZ)
+    return datetime(today.year, today.month, today.day, hh, mm, tzinfo=TZ)
 
 def build_xml(programmes, for_date: date):
     tv = ET.Element("tv", {
@@ -63,21 +84,16 @@ def build_xml(programmes, for_date: date):
     dn = ET.SubElement(ch, "display-name")
     dn.text = CHANNEL_NAME
 
-    for i, (dt_start, title) in enumerate(programmes):
-        if i + 1 < len(programmes):
-            dt_stop = programmes[i + 1][0]
-        else:
-            next_day = (for_date + timedelta(days=1))
-            dt_stop = datetime.combine(next_day, time(0, 0)).replace(tzinfo=TZ)
-
-        start_str = dt_start.strftime("%Y%m%d%H%M%S") + " +0700"
-        stop_str = dt_stop.strftime("%Y%m%d%H%M%S") + " +0700"
-        p = ET.SubElement(tv, "programme", {
-            "start": start_str,
-            "stop": stop_str,
-            "channel": CHANNEL_ID
-        })
-        t = ET.SubElement(p, "title", {"lang": "vi"})
+    # chương trình cuối kết thúc lúc 00:00 ngày hôm sau
+    day_end = datetime.combine(for_date + timedelta(days=1), time(0, 0), tzinfo=TZ)
+
+    for (dt_start, title), nxt in zip_longest(programmes, programmes[1:]):
+        dt_stop = nxt[0] if nxt is not None else day_end
+
+        start_str = dt_start.strftime(XMLTV_TIME_FMT)
+        stop_str = dt_stop.strftime(XMLTV_TIME_FMT)
+        p = ET.SubElement(tv, "programme", start=start_str, stop=stop_str, channel=CHANNEL_ID)
+        t = ET.SubElement(p, "title", TITLE_ATTRS)
         t.text = title
 
     xml_str = ET.tostring(tv, encoding="utf-8")
@@ -119,7 +135,8 @@ def main():
             continue
         prog_list.append((dt, title))
 
-    prog_list.sort(key=lambda x: x[0])
+    # bảng thường đã theo thứ tự giờ phát: Timsort chỉ cần một lượt tuyến tính
+    prog_list.sort(key=itemgetter(0))
 
     xml_bytes = build_xml(prog_list, today)
     with open(OUT_FILE, "wb") as f:
@@ -1,9 +1,11 @@
 # boomerang.py (fixed: normalize early-hours assigned to previous day)
+import os
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from bs4 import BeautifulSoup, SoupStrainer
 from datetime import datetime, timedelta, timezone
-import xml.etree.ElementTree as ET
-import xml.sax.saxutils as sax
+from itertools import zip_longest
 
 # ========== CONFIG ==========
 CHANNEL_ID = "boomerang"
@@ -11,17 +13,31 @@ CHANNEL_NAME = "CARTOONITO"
 BASE_URL = "https://info.msky.vn/vn/Boomerang.html?date={date}"  # date in dd/mm/YYYY
 OUTPUT_FILE = "boomerang.xml"
 VN_TZ = timezone(timedelta(hours=7))
+XMLTV_TIME_FMT = "%Y%m%d%H%M%S +0700"
+ONE_DAY = timedelta(days=1)
+LAST_PROG_DURATION = timedelta(minutes=30)  # chương trình cuối không có mốc kết thúc
+DEBUG = bool(os.environ.get("LPS_DEBUG"))  # LPS_DEBUG=1 để in danh sách chương trình
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (compatible; lps_crawler/1.0; +https://github.com/hoanghai81/lps_crawler)",
+    "Accept-Encoding": "gzip, deflate",
+}
 # ============================
 
+# Session dùng chung (keep-alive + retry khi lỗi kết nối)
+SESSION = requests.Session()
+SESSION.headers.update(HEADERS)
+SESSION.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=4,
+                                      max_retries=Retry(total=2, backoff_factor=0.3)))
+
 
 def fetch_html_for_date(date_str):
-    """Tải HTML của trang cho date_str định dạng dd/mm/YYYY"""
+    """Tải HTML (bytes, utf-8) của trang cho date_str định dạng dd/mm/YYYY"""
     url = BASE_URL.format(date=date_str)
     print(f"Fetching: {url}")
-    resp = requests.get(url, timeout=20)
+    resp = SESSION.get(url, timeout=20)
     resp.raise_for_status()
-    resp.encoding = "utf-8"
-    return resp.text
+    # trả bytes (trang là utf-8): parser giải mã trực tiếp, không qua resp.text
+    return resp.content
 
 
 def parse_table_rows(html, base_date):
@@ -30,7 +46,9 @@ def parse_table_rows(html, base_date):
       { 'start_dt': datetime(tz=VN_TZ), 'title_vi': str, 'title_en': str_or_empty }
     Sử dụng chiến lược last_dt để xử lý rollover qua ngày tiếp theo.
     """
-    soup = BeautifulSoup(html, "html.parser")
+    # chỉ dựng cây cho <table>: bỏ qua head/script/menu... dù trang có phình to
+    soup = BeautifulSoup(html, "lxml", from_encoding="utf-8",
+                         parse_only=SoupStrainer("table"))
     table = soup.find("table")
     if not table:
         print("⚠️ Không tìm thấy bảng EPG")
@@ -38,12 +56,19 @@ def parse_table_rows(html, base_date):
 
     rows = table.find_all("tr")
     items = []
+    # bất biến trong vòng lặp: gán vào biến cục bộ (LOAD_FAST thay vì tra global)
+    append = items.append
+    one_day = ONE_DAY
+
+    # mốc 00:00 của base_date, tính một lần: mỗi dòng chỉ cần .replace(hour, minute)
+    base_dt = datetime.combine(base_date, datetime.min.time(), tzinfo=VN_TZ)
 
     last_dt = None
 
     # bỏ header nếu có
     for tr in rows[1:]:
-        tds = tr.find_all("td")
+        # ô của dòng luôn là con trực tiếp của <tr>: không cần duyệt cả cây con
+        tds = tr.find_all("td", recursive=False)
         if not tds or len(tds) < 2:
             continue
 
@@ -56,16 +81,15 @@ def parse_table_rows(html, base_date):
             # bỏ nếu không có giờ
             continue
 
-        # đảm bảo giờ dạng HH:MM
-        parts = time_str.split(":")
-        hh = parts[0].zfill(2)
-        mm = parts[1].zfill(2)
-        time_norm = f"{hh}:{mm}"
-
-        # tạo datetime tạm dựa trên base_date
+        # tạo datetime tạm dựa trên base_date từ giờ/phút dạng H:MM hoặc HH:MM
+        # (chỉ bỏ phần giây ':SS' phía sau; phút phải là 1-2 chữ số,
+        #  nếu không thì bỏ dòng thay vì đọc sai giờ)
         try:
-            start_dt = datetime.strptime(f"{base_date.strftime('%d/%m/%Y')} {time_norm}", "%d/%m/%Y %H:%M")
-            start_dt = start_dt.replace(tzinfo=VN_TZ)
+            hh_s, _, mm_s = time_str.partition(":")
+            mm_s = mm_s.partition(":")[0].strip()
+            if not (mm_s.isdigit() and len(mm_s) <= 2):
+                raise ValueError(f"phút không hợp lệ: {mm_s!r}")
+            start_dt = base_dt.replace(hour=int(hh_s), minute=int(mm_s))
         except Exception as e:
             print(f"⚠️ Bỏ qua dòng thời gian không parse được: '{time_str}' ({e})")
             continue
@@ -73,10 +97,10 @@ def parse_table_rows(html, base_date):
         # Nếu đã có last_dt và start_dt <= last_dt => chương trình đã sang ngày tiếp theo
         if last_dt is not None:
             while start_dt <= last_dt:
-                start_dt += timedelta(days=1)
+                start_dt += one_day
 
         # append item (stop tính sau)
-        items.append({
+        append({
             "start_dt": start_dt,
             "title_vi": title_vi,
             "title_en": title_en,
@@ -95,19 +119,20 @@ def compute_stops(items):
     - ngược lại stop = start của chương trình tiếp theo
     - chương trình cuối mặc định 30 phút
     """
-    for i, it in enumerate(items):
+    # ghép từng mục với mục kế tiếp (mục cuối ghép với None)
+    for it, nxt in zip_longest(items, items[1:]):
         start = it["start_dt"]
         dur = it.get("duration_min")
         if dur and isinstance(dur, int) and dur > 0:
             stop = start + timedelta(minutes=dur)
         else:
-            if i + 1 < len(items):
-                stop = items[i + 1]["start_dt"]
+            if nxt is not None:
+                stop = nxt["start_dt"]
                 # nếu stop <= start (không hợp lệ) thì cộng 1 ngày để an toàn
                 if stop <= start:
-                    stop += timedelta(days=1)
+                    stop += ONE_DAY
             else:
-                stop = start + timedelta(minutes=30)
+                stop = start + LAST_PROG_DURATION
         it["stop_dt"] = stop
     return items
 
@@ -124,7 +149,7 @@ def normalize_early_hours_to_base_date(items, base_date):
         if sd.date() < base_date and sd.hour < 4:
             # shift forward until date == base_date (tránh shift quá)
             while sd.date() < base_date:
-                sd = sd + timedelta(days=1)
+                sd = sd + ONE_DAY
             # adjust stop_dt tương ứng (nếu stop_dt <= old start => cộng cùng số ngày)
             delta_days = (sd.date() - it["start_dt"].date()).days
             it["start_dt"] = sd
@@ -141,40 +166,54 @@ def filter_only_today(items, base_date):
     Lọc chỉ giữ chương trình có start thuộc ngày base_date (giờ VN).
     base_date: datetime.date (VN)
     """
-    start_day = datetime.combine(base_date, datetime.min.time()).replace(tzinfo=VN_TZ)
-    end_day = start_day + timedelta(days=1)
+    start_day = datetime.combine(base_date, datetime.min.time(), tzinfo=VN_TZ)
+    end_day = start_day + ONE_DAY
     filtered = [it for it in items if start_day <= it["start_dt"] < end_day]
     return filtered
 
 
-def build_xml(items, output_file=OUTPUT_FILE):
-    tv = ET.Element("tv", {
-        "source-info-name": "msky.vn",
-        "generator-info-name": "lps_crawler"
-    })
+XML_HEADER = (
+    "<?xml version='1.0' encoding='utf-8'?>\n"
+    '<tv source-info-name="msky.vn" generator-info-name="lps_crawler">\n'
+    '  <channel id="{cid}">\n'
+    "    <display-name>{name}</display-name>\n"
+    "    <url>https://info.msky.vn/vn/Boomerang.html</url>\n"
+    "  </channel>\n"
+)
+PROG_TMPL = (
+    # channel id cố định: ghép sẵn vào template, không format lại mỗi dòng
+    '  <programme start="{s}" stop="{e}" channel="' + CHANNEL_ID + '">\n'
+    '    <title lang="vi">{tv}</title>\n'
+    "{te}"
+    "  </programme>\n"
+)
+TITLE_EN_TMPL = '    <title lang="en">{te}</title>\n'
 
-    ch = ET.SubElement(tv, "channel", {"id": CHANNEL_ID})
-    ET.SubElement(ch, "display-name").text = CHANNEL_NAME
-    ET.SubElement(ch, "url").text = "https://info.msky.vn/vn/Boomerang.html"
+_XML_ESCAPE_TABLE = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;"})
 
-    for it in items:
-        start_s = it["start_dt"].strftime("%Y%m%d%H%M%S ") + "+0700"
-        stop_s = it["stop_dt"].strftime("%Y%m%d%H%M%S ") + "+0700"
-        prog = ET.SubElement(tv, "programme", {
-            "start": start_s,
-            "stop": stop_s,
-            "channel": CHANNEL_ID
-        })
-        ET.SubElement(prog, "title", {"lang": "vi"}).text = sax.escape(it["title_vi"] or "")
-        if it.get("title_en"):
-            ET.SubElement(prog, "title", {"lang": "en"}).text = sax.escape(it["title_en"])
 
-    tree = ET.ElementTree(tv)
-    try:
-        ET.indent(tree, space="  ", level=0)
-    except Exception:
-        pass
-    tree.write(output_file, encoding="utf-8", xml_declaration=True)
+def xml_escape(text):
+    """Escape text node: đa số title không có ký tự đặc biệt nên trả về luôn."""
+    if "&" in text or "<" in text or ">" in text:
+        return text.translate(_XML_ESCAPE_TABLE)
+    return text
+
+
+def build_xml(items, output_file=OUTPUT_FILE):
+    """
+    Ghi XMLTV trực tiếp bằng template (cấu trúc cố định), không dựng cây ET.
+    Chỉ escape phần text (title) bằng xml_escape.
+    """
+    # buffer 64 KiB: cả file (vài chục KB) được ghi xuống đĩa trong một lần
+    with open(output_file, "w", encoding="utf-8", buffering=1 << 16) as f:
+        f.write(XML_HEADER.format(cid=CHANNEL_ID, name=xml_escape(CHANNEL_NAME)))
+        for it in items:
+            start_s = it["start_dt"].strftime(XMLTV_TIME_FMT)
+            stop_s = it["stop_dt"].strftime(XMLTV_TIME_FMT)
+            te = TITLE_EN_TMPL.format(te=xml_escape(it["title_en"])) if it.get("title_en") else ""
+            f.write(PROG_TMPL.format(s=start_s, e=stop_s,
+                                     tv=xml_escape(it["title_vi"] or ""), te=te))
+        f.write("</tv>")
     print(f"✅ Xuất thành công {output_file} ({len(items)} programmes)")
 
 
@@ -199,14 +238,15 @@ def main():
     # Lọc chỉ giữ chương trình start thuộc ngày hiện tại (VN)
     filtered = filter_only_today(items, base_date)
 
-    # Debug prints (in danh sách start để anh kiểm tra)
-    print("=== Program starts (all parsed) ===")
-    for it in items[:200]:
-        print(it["start_dt"].strftime("%Y-%m-%d %H:%M:%S %z"), "-", it["title_vi"])
+    # Debug prints (in danh sách start để anh kiểm tra) — chỉ khi bật LPS_DEBUG
+    if DEBUG:
+        print("=== Program starts (all parsed) ===")
+        for it in items[:200]:
+            print(it["start_dt"].strftime("%Y-%m-%d %H:%M:%S %z"), "-", it["title_vi"])
 
-    print("=== Program starts (filtered = today) ===")
-    for it in filtered[:200]:
-        print(it["start_dt"].strftime("%Y-%m-%d %H:%M:%S %z"), "-", it["title_vi"])
+        print("=== Program starts (filtered = today) ===")
+        for it in filtered[:200]:
+            print(it["start_dt"].strftime("%Y-%m-%d %H:%M:%S %z"), "-", it["title_vi"])
 
     build_xml(filtered, OUTPUT_FILE)
 